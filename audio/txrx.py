@@ -2,6 +2,7 @@ import pyaudio
 import numpy as np
 from time import sleep
 import array
+import sys
 
 """
 TXRX:
@@ -84,30 +85,32 @@ def _prepare_for_sound(mls):
             new_mls.append(int_max)
     # 16-bit array.
     return array.array('h',new_mls)
- 
+
 def sonar_probe(mls):
     """
     Sonar probe does the following:
     - Starts recording.
     - Plays the MLS.
     - Keeps recording for one MLS duration after the MLS completes.
-    - Returns a list containing the recording.
+    - Returns a 16-bit array containing the recording.
     
-    It accepts a list of 1's and 0's as its only argument.
+    It accepts a list of 1's and 0's, or an array('h') of samples that are
+    ready to play as they are, such as a Plan's transmit buffer.
     """
     # Simple audio callback.
     def audio_callback(in_data, frame_count, time_info, status):
         data = pulse.consume(frame_count)
         data = bytes(data)
-        recording.extend(in_data)
+        recording.frombytes(in_data)
         if pulse.is_done():
             return (data, pyaudio.paComplete)
         else:
             return (data, pyaudio.paContinue)
 
-    recording = []
+    recording = array.array('h')
     length = len(mls)
-    mls    = _prepare_for_sound(mls)
+    if not (isinstance(mls, array.array) and mls.typecode == 'h'):
+        mls = _prepare_for_sound(mls)
     pulse  = _Buffer(mls + array.array('h', ([0] * length)), 0)
     
     audio_ctx = pyaudio.PyAudio()
@@ -119,7 +122,9 @@ def sonar_probe(mls):
                             frames_per_buffer=CHUNK,
                             stream_callback=audio_callback)
 
-    print("[-] Sending one pulse, sample length is %s..." % str(length))
+    # stderr, so the JSON lines the CLI writes to stdout stay clean.
+    print("[-] Sending one pulse, sample length is %s..." % str(length),
+          file=sys.stderr)
     while stream.is_active():
         sleep(0.1)
 
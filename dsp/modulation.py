@@ -1,6 +1,9 @@
 #!/usr/bin/python3
 
+import array
 import numpy as np
+from functools import lru_cache
+import scipy.signal as sig
 
 """
 modulation.py:
@@ -29,10 +32,25 @@ slightly with each reflection.
     a signal that has several peaks superposed on some low-frequency distortion
     produced by the overlapping M-sequences.
 3. The correlation must be high-passed to remove this low-frequency distortion.
-4. Peaks are then selected.
+    The filter starts settled on the first lag, or its startup transient
+    would swamp the echoes near the start.
+4. Peaks are then selected, at least a few chips apart so one echo is not
+    reported several times.
+
+Every receive stage takes a dtype argument. The recording is only 16-bit, so
+np.float32 is plenty for long sequences and halves the memory traffic. The
+default is PRECISION.
 """
 
 TIMESTRETCH = 8
+PRECISION   = np.float64
+#5th order butterworth filter. The knee is well above the LF distortion but
+#below the band of a correlation peak (a few chips wide), which a knee near
+#Nyquist would filter away along with the distortion.
+HIGHPASS_ORDER  = 5
+HIGHPASS_CUTOFF = 0.2
+# Chips between reported peaks.
+PEAK_SEPARATION = 4
 
 def stretch(seq, n):
     """
@@ -59,43 +77,151 @@ def modulate_pulse(pulse, space=TIMESTRETCH, dco=0):
     
     return modulated
 
-def demodulate_pulse(rx, space=TIMESTRETCH):
+def demodulate_pulse(rx, space=TIMESTRETCH, dtype=PRECISION):
     """
     Demodulate the MLS from the received signal, per step 1 of RX.
+    dtype is the floating point type used for the samples and the DFT.
+
+    Only one bin of each window's DFT is wanted, so rather than running an
+    FFT per window we convolve with that bin's kernel. With an even space
+    the bin is at Nyquist and the kernel is just +1, -1, +1, ...
+    """
+    rx = np.asarray(rx, dtype=dtype)
+    if len(rx) <= space:
+        return np.zeros(0, dtype=dtype)
+
+    k = space // 2
+    if 2 * k == space:
+        kernel = np.ones(space, dtype=dtype)
+        kernel[1::2] = -1
+    else:
+        kernel = np.exp(-2j * np.pi * k * np.arange(space) / space)
+        kernel = kernel.astype(np.result_type(dtype, np.complex64))
+    # Convolution runs the kernel backwards; the last window isn't used.
+    bins   = np.convolve(rx, kernel[::-1], mode='valid')[:-1]
+    scores = np.abs(bins) / 8
+
+    return scores.astype(dtype, copy=False)
+
+def demodulate_fixed(rx, space=TIMESTRETCH):
+    """
+    Fixed-point version of demodulate_pulse for int16 recordings, such as
+    the ones sonar_probe returns. No floats are involved: with the carrier at
+    Nyquist, the FFT bin we want is just the window's sum with alternating
+    signs, so we flip every other sample and take windowed sums from a
+    running total in int32.
+
+    space must be even, since only then is the bin demodulate_pulse reads at
+    Nyquist. Returns int32 scores that are 8 times those of demodulate_pulse,
+    since that divides by 8; the scale drops out of correlation.
+
+    rx must be an int16 ndarray or an array('h'); anything else would have
+    to be cast, and could wrap around.
     """
-    rx = np.array(rx)
-    demodulated = []
-    #FIXME: Python loop overhead makes this excruciatingly slow!
-    #       Cython might work in a pinch, but this needs to be
-    #       very tight if we're going to use long sequences.
-    for win_start in range(len(rx) - space):
-        windowed = rx[win_start : win_start+space]
-        dft      = np.fft.fft(windowed)
-        score    = np.abs(dft[int(len(dft)/2)]) / 8
+    if space % 2:
+        raise ValueError("Fixed-point demodulation needs an even space.")
+    if isinstance(rx, array.array) and rx.typecode == 'h':
+        rx = np.frombuffer(rx, dtype=np.int16)
+    elif not isinstance(rx, np.ndarray) or rx.dtype != np.int16:
+        raise ValueError("Fixed-point demodulation needs int16 samples, not %s."
+                         % getattr(rx, "dtype", type(rx).__name__))
+    if len(rx) <= space:
+        return np.zeros(0, dtype=np.int32)
+
+    running = np.zeros(len(rx) + 1, dtype=np.int32)
+    running[1:] = rx
+    running[2::2] *= -1
+    # The running total may wrap, but int32 arithmetic wraps consistently,
+    # so each window's difference is still exact.
+    np.cumsum(running, out=running)
+    sums = running[space:-1] - running[:-space - 1]
+
+    return np.abs(sums, out=sums)
+
+def design_highpass(order=HIGHPASS_ORDER, cutoff=HIGHPASS_CUTOFF,
+                    dtype=PRECISION):
+    """
+    Design the high-pass for step 3 of RX as second-order sections, which
+    are better conditioned than the transfer function form. Each design is
+    made once and shared, so it is read-only.
+    """
+    # np.float32 and np.dtype('float32') should share a design.
+    return _design_highpass(order, cutoff, np.dtype(dtype))
 
-        demodulated.append(score)
+@lru_cache(maxsize=None)
+def _design_highpass(order, cutoff, dtype):
+    sos = sig.butter(order, cutoff, 'highpass', output='sos').astype(dtype)
+    sos.flags.writeable = False
+    return sos
 
-    return demodulated
+class HighPass:
+    """
+    The step 3 high-pass, carrying its state between calls. Filtering a
+    correlation in consecutive pieces gives the same result as filtering it
+    all at once. Unless told otherwise with settle, the filter settles on
+    the first value it sees.
+    """
+    def __init__(self, order=HIGHPASS_ORDER, cutoff=HIGHPASS_CUTOFF,
+                 dtype=PRECISION):
+        # sosfilt won't take a read-only array, and the copy is tiny.
+        self.sos   = design_highpass(order, cutoff, dtype).copy()
+        self.dtype = dtype
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the state, as if nothing had been filtered yet.
+        """
+        self.state = None
+
+    def settle(self, value):
+        """
+        Set the state as if value had been filtered forever, so a piece
+        starting at value has no startup transient.
+        """
+        self.state = (sig.sosfilt_zi(self.sos) * value).astype(self.dtype)
+
+    def filter(self, corr):
+        """
+        Filter the next piece of a correlation.
+        """
+        corr = np.asarray(corr, dtype=self.dtype)
+        if len(corr) == 0:
+            return corr
+        if self.state is None:
+            self.settle(corr[0])
+        filtered, self.state = sig.sosfilt(self.sos, corr, zi=self.state)
+        return filtered
+
+def highpass(corr, dtype=PRECISION):
+    """
+    High-pass a whole correlation, per step 3 of RX.
+    """
+    return HighPass(dtype=dtype).filter(corr)
 
 def find_reflections(demodulated, ideal, n=1, scaling=TIMESTRETCH,
-                      ignore_highest=False):
+                      ignore_highest=False, dtype=PRECISION):
     """
     Find how many samples in the reflections are present.
     To do so, correlate the demodulated m-sequence with the ideal one,
-    high-pass to remove LF noise, and return n highest values.
+    high-pass to remove LF noise, and return the n highest peaks, at least
+    PEAK_SEPARATION chips of scaling samples apart, weakest first.
 
     It may be desirable to ignore the highest peak, as it might just be
     the direct speaker -> microphone path.
+
+    dtype is the floating point type used for correlation and filtering.
+    Peaks are picked over the whole correlation; to high-pass one that
+    arrives in pieces, feed them to a single HighPass.
     """
+    demodulated = np.asarray(demodulated, dtype=dtype)
+    ideal       = np.asarray(ideal, dtype=dtype)
     corr = np.correlate(demodulated, ideal, mode='valid')
-    #5th order butterworth filter with knee point just below
-    #Nyquist
-    p,q  = sig.butter(5, 0.975, 'highpass')
-    filtered = sig.lfilter(p,q, corr)
+    filtered = highpass(corr, dtype)
 
-    which_highest = np.argsort(filtered)[-n:]
+    peaks, _ = sig.find_peaks(filtered, distance=PEAK_SEPARATION * scaling)
+    which_highest = peaks[np.argsort(filtered[peaks], kind='stable')][-n:]
 
     if ignore_highest:
         return which_highest[:-1]
     return which_highest
-    
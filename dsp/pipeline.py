@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+
+import array
+import time
+import wave
+from collections import OrderedDict
+from functools   import lru_cache
+
+import numpy as np
+from mlsmath.mls    import make_mls
+from dsp.modulation import stretch, modulate_pulse, demodulate_pulse, \
+                           demodulate_fixed, find_reflections, \
+                           TIMESTRETCH, PRECISION
+
+"""
+pipeline.py:
+
+Glue the sonar stages together for the command line tool: build (and cache)
+everything that only depends on the probe settings, then run captures
+through demodulation and correlation, timing each stage as we go.
+
+Nothing here touches the audio hardware, so batch runs work on machines
+without pyaudio.
+"""
+
+# Peak 16-bit sample value for transmission, as in audio.txrx.
+TX_AMPLITUDE = 2**15 - 2
+
+class Plan:
+    """
+    Everything derived from the probe settings alone: the m-sequence, the
+    modulated pulse, its 16-bit transmit buffer and the ideal sequence to
+    correlate with.
+    """
+    def __init__(self, degree, space=TIMESTRETCH, dtype=PRECISION):
+        self.degree = degree
+        self.space  = space
+        self.dtype  = dtype
+        self.mls    = make_mls(degree)
+        self.pulse  = modulate_pulse(self.mls, space)
+        # Ready for sonar_probe to play as is.
+        samples       = np.round(np.array(self.pulse) * TX_AMPLITUDE)
+        self.transmit = array.array('h', samples.astype(np.int16).tobytes())
+        # Bipolar, so the correlation doesn't pick up the demodulated DC.
+        ideal       = np.array(stretch(self.mls, space), dtype=dtype)
+        self.ideal  = 2 * ideal - 1
+
+@lru_cache(maxsize=None)
+def make_plan(degree, space=TIMESTRETCH, dtype=PRECISION):
+    """
+    Return the Plan for these settings, building it only the first time.
+    """
+    return Plan(degree, space, dtype)
+
+class Timer:
+    """
+    Accumulate wall-clock time per named stage.
+    """
+    def __init__(self):
+        self.timings = OrderedDict()
+
+    def stage(self, name, fn, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs), charging the time it takes to name.
+        """
+        start  = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.timings[name] = self.timings.get(name, 0.0) + \
+                             time.perf_counter() - start
+        return result
+
+def load_capture(path):
+    """
+    Read a recorded capture as int16 samples. Accepts 16-bit mono .wav files
+    and .npy arrays.
+    """
+    if path.endswith(".npy"):
+        samples = np.load(path)
+        if samples.dtype != np.int16:
+            raise ValueError("Capture %s is %s, not int16." %
+                             (path, samples.dtype))
+        return samples
+
+    with wave.open(path, "rb") as capture:
+        if capture.getsampwidth() != 2 or capture.getnchannels() != 1:
+            raise ValueError("Capture %s is not 16-bit mono." % path)
+        frames = capture.readframes(capture.getnframes())
+    return np.frombuffer(frames, dtype="<i2")
+
+def process(rx, plan, n=1, ignore_highest=False, tracker=None, timer=None,
+            fixed=False, source="recording"):
+    """
+    Demodulate a recording and find its reflections using plan. If a
+    Tracker is given, it is used in place of a full find_reflections. If
+    fixed is True, the int16 recording is demodulated in fixed point.
+    source names the recording in errors.
+    """
+    if timer is None:
+        timer = Timer()
+    if len(rx) <= len(plan.ideal) + plan.space:
+        raise ValueError("%s has %d samples, too short for a %d-sample probe."
+                         % (source, len(rx), len(plan.ideal)))
+
+    if fixed:
+        demodulated = timer.stage("demodulate", demodulate_fixed, rx,
+                                  plan.space)
+    else:
+        demodulated = timer.stage("demodulate", demodulate_pulse, rx,
+                                  plan.space, dtype=plan.dtype)
+    if tracker is not None:
+        return timer.stage("correlate", tracker.update, demodulated)
+    return timer.stage("correlate", find_reflections, demodulated,
+                       plan.ideal, n=n, scaling=plan.space,
+                       ignore_highest=ignore_highest, dtype=plan.dtype)
+
+def process_capture(path, degree, space=TIMESTRETCH, dtype=PRECISION, n=1,
+                    ignore_highest=False, fixed=False):
+    """
+    Run one recorded capture through the pipeline and return its record.
+    Takes only picklable arguments so it can run in a worker process; each
+    worker builds its plan once and reuses it.
+    """
+    timer = Timer()
+    plan  = timer.stage("plan", make_plan, degree, space, dtype)
+    rx    = timer.stage("load", load_capture, path)
+    found = process(rx, plan, n, ignore_highest, timer=timer, fixed=fixed,
+                    source="Capture %s" % path)
+
+    return {"source": path,
+            "reflections": [int(lag) for lag in found],
+            "timings": timer.timings}
@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+
+import numpy as np
+from functools import lru_cache
+from dsp.modulation import find_reflections, HighPass, TIMESTRETCH, \
+                           PRECISION, PEAK_SEPARATION
+
+"""
+tracking.py:
+
+In steady-state ranging the reflectors barely move between pings, so running
+find_reflections over every lag of every ping is mostly wasted work. The
+Tracker here remembers where the echoes were, predicts where they will be
+next, and only correlates in a narrow window of lags around each prediction.
+
+A full search (plain find_reflections) is done on the first ping, every
+full_every pings after that, and whenever a target looks lost: its peak sits on
+the edge of its window, it comes closer to another target than find_reflections
+could resolve, or its score collapses relative to the last ping.
+"""
+
+# The correlation rides on an LF level up to a million times the echoes, so
+# the high-pass must settle to well below that before a window begins.
+SETTLE_TOLERANCE = 1e-9
+
+@lru_cache(maxsize=None)
+def settle_length(tolerance=SETTLE_TOLERANCE):
+    """
+    Number of lags after which the high-pass impulse response stays below
+    tolerance times its peak. About 120 for the default filter.
+    """
+    impulse = np.zeros(1 << 14)
+    impulse[0] = 1
+    response = np.abs(HighPass(dtype=np.float64).filter(impulse))
+    above = np.nonzero(response >= tolerance * response.max())[0]
+    return int(above[-1]) + 1
+
+class Tracker:
+    """
+    Track reflection positions across successive demodulated pings.
+    """
+    def __init__(self, ideal, n=1, window=16, full_every=16,
+                 loss_ratio=0.5, ignore_highest=False, scaling=TIMESTRETCH,
+                 dtype=PRECISION):
+        """
+        ideal is the stretched m-sequence to correlate against. n, scaling
+        and ignore_highest are passed to find_reflections for full searches.
+        window is the number of lags searched either side of a prediction,
+        full_every is how many pings may pass between full searches, and a
+        target whose score drops below loss_ratio times its previous score
+        triggers a full search.
+        """
+        self.ideal          = np.asarray(ideal, dtype=dtype)
+        self.n              = n
+        self.window         = window
+        self.full_every     = full_every
+        self.loss_ratio     = loss_ratio
+        self.ignore_highest = ignore_highest
+        self.scaling        = scaling
+        self.dtype          = dtype
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all targets; the next update does a full search.
+        """
+        self.positions  = np.zeros(0, dtype=int)
+        self.velocities = np.zeros(0, dtype=int)
+        self.scores     = np.zeros(0, dtype=self.dtype)
+        self.since_full = None
+
+    def update(self, demodulated):
+        """
+        Find the reflections in a new demodulated ping and return their
+        positions, as find_reflections would.
+        """
+        demodulated = np.asarray(demodulated, dtype=self.dtype)
+        n_lags = len(demodulated) - len(self.ideal) + 1
+
+        if self._needs_full_search():
+            return self._full_search(demodulated)
+
+        predicted = np.clip(self.positions + self.velocities, 0, n_lags - 1)
+        bounds    = self._windows(predicted, n_lags)
+        filtered  = self._highpassed_windows(demodulated, bounds)
+        positions = []
+        scores    = []
+        for (lo, hi, open_lo, open_hi), window in zip(bounds, filtered):
+            best = int(np.argmax(window))
+            # A peak on the outer edge of the window has probably walked out
+            # of it. Edges shared with a neighbouring target don't count.
+            on_edge = (best == 0 and open_lo) or \
+                      (best == len(window) - 1 and open_hi)
+            if on_edge:
+                return self._full_search(demodulated)
+            positions.append(lo + best)
+            scores.append(window[best])
+
+        scores = np.array(scores, dtype=self.dtype)
+        if np.any(scores < self.loss_ratio * self.scores):
+            return self._full_search(demodulated)
+
+        positions = np.array(positions, dtype=int)
+        # Targets closer than find_reflections keeps peaks apart have merged
+        # onto one peak and need re-separating.
+        if np.any(np.diff(np.sort(positions)) < PEAK_SEPARATION * self.scaling):
+            return self._full_search(demodulated)
+
+        self.velocities = positions - self.positions
+        self.positions  = positions
+        self.scores     = scores
+        self.since_full += 1
+        return positions
+
+    def _windows(self, predicted, n_lags):
+        """
+        Return (lo, hi, open_lo, open_hi) lag windows around each predicted
+        position. Neighbouring targets split the lags between them at their
+        midpoint, so two targets can't both claim the same peak. open_lo and
+        open_hi say whether that edge is a search limit the peak could have
+        crossed, rather than a neighbour or the end of the correlation.
+        """
+        order  = np.argsort(predicted, kind='stable')
+        bounds = [None] * len(predicted)
+        for rank, i in enumerate(order):
+            guess = predicted[i]
+            lo, open_lo = guess - self.window, True
+            hi, open_hi = guess + self.window + 1, True
+            if lo <= 0:
+                lo, open_lo = 0, False
+            if hi >= n_lags:
+                hi, open_hi = n_lags, False
+            if rank > 0:
+                split = (predicted[order[rank - 1]] + guess + 1) // 2
+                if split >= lo:
+                    lo, open_lo = split, False
+            if rank < len(order) - 1:
+                split = (guess + predicted[order[rank + 1]] + 1) // 2
+                if split <= hi:
+                    hi, open_hi = split, False
+            bounds[i] = (lo, max(hi, lo + 1), open_lo, open_hi)
+        return bounds
+
+    def _highpassed_windows(self, demodulated, bounds):
+        """
+        High-pass each window in bounds, sharing one filtered span between
+        windows close enough that their lead-ins would overlap.
+        """
+        lead  = settle_length()
+        spans = []
+        for lo, hi, _, _ in sorted(bounds):
+            if spans and lo - lead <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], hi)
+            else:
+                spans.append([lo, hi])
+
+        filtered = {}
+        for lo, hi in spans:
+            filtered[lo] = self._local_highpassed(demodulated, lo, hi)
+
+        windows = []
+        for lo, hi, _, _ in bounds:
+            span_lo = max(start for start in filtered if start <= lo)
+            windows.append(filtered[span_lo][lo - span_lo : hi - span_lo])
+        return windows
+
+    def _needs_full_search(self):
+        return self.since_full is None or \
+               self.since_full >= self.full_every or \
+               len(self.positions) == 0
+
+    def _full_search(self, demodulated):
+        """
+        Run find_reflections over every lag and re-seed the targets.
+        """
+        positions = find_reflections(demodulated, self.ideal, n=self.n,
+                                     scaling=self.scaling,
+                                     ignore_highest=self.ignore_highest,
+                                     dtype=self.dtype)
+        positions = np.asarray(positions, dtype=int)
+        # find_reflections orders by score, so we can't pair targets up with
+        # the previous ping; start them all stationary.
+        self.scores = np.array([self._score_at(demodulated, p)
+                                for p in positions], dtype=self.dtype)
+        self.positions  = positions
+        self.velocities = np.zeros(len(positions), dtype=int)
+        self.since_full = 0
+        return positions
+
+    def _score_at(self, demodulated, lag):
+        filtered = self._local_highpassed(demodulated, lag, lag + 1)
+        return filtered[-1]
+
+    def _local_highpassed(self, demodulated, lo, hi):
+        """
+        Correlate only lags lo to hi (exclusive) and high-pass the result so
+        it matches the same lags of the whole-array high-pass.
+
+        Near the start we filter from lag 0, exactly as the whole array is.
+        Otherwise we start settle_length() lags early, settled on the first
+        of them, so only the correlation's wander in that lead-in, not its
+        level, leaks through, and that has decayed by lo.
+        """
+        lead  = settle_length()
+        start = max(lo - lead, 0)
+        chunk = demodulated[start : hi + len(self.ideal) - 1]
+        corr  = np.correlate(chunk, self.ideal, mode='valid')
+        return HighPass(dtype=self.dtype).filter(corr)[lo - start:]
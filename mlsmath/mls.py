@@ -1,3 +1,4 @@
+import os
 from mlsmath.lfsr import LFSR
 from mlsmath.polynomial import Term
 from mlsmath.modtwo     import MTPolynomial 
@@ -10,7 +11,7 @@ The top of the file contains some parsing functions to read the generator
 polynomial definitions.
 """
 
-GENERATOR_FILE = "mlsmath/generators.text"
+GENERATOR_FILE = os.path.join(os.path.dirname(__file__), "generators.text")
 
 def _strip_after_pound(string):
     """
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The packages live at the top of the repository, next to ghettosonar.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+def _simulate_capture(plan, delays, seed=0):
+    """
+    Simulate an int16 recording of plan's pulse with echoes at delays.
+    """
+    pulse = np.array(plan.pulse) * 12000
+    rx    = np.zeros(2 * len(pulse))
+    for delay, amplitude in delays:
+        rx[delay : delay + len(pulse)] += amplitude * pulse
+    rx += np.random.default_rng(seed).normal(0, 300, len(rx))
+    return rx.astype(np.int16)
+
+@pytest.fixture
+def simulate_capture():
+    """
+    simulate_capture(plan, delays, seed=0): an int16 recording of plan's
+    pulse with (delay, amplitude) echoes.
+    """
+    return _simulate_capture
@@ -0,0 +1,105 @@
+import array
+
+import numpy as np
+import pytest
+from dsp.modulation import demodulate_pulse, demodulate_fixed, \
+                           find_reflections, highpass, design_highpass, \
+                           HighPass, TIMESTRETCH
+from dsp.pipeline   import make_plan
+
+"""
+Accuracy of the receive paths: float64 must find the simulated echoes, and
+the float32 and fixed-point paths must agree with it.
+"""
+
+DELAYS = [(1500, 1.0), (4000, 0.6), (6500, 0.3)]
+# Reported lags may differ from the simulated delays by at most this many
+# samples: half a chip.
+PEAK_TOLERANCE = TIMESTRETCH // 2
+# The float32 and fixed-point paths may differ from float64 by at most this.
+PRECISION_TOLERANCE = 1
+
+def _peaks(demodulated, plan, dtype, n=len(DELAYS)):
+    ideal = plan.ideal.astype(dtype)
+    return np.sort(find_reflections(demodulated, ideal, n=n, dtype=dtype))
+
+def _assert_close(peaks, reference, tolerance):
+    assert len(peaks) == len(reference)
+    assert np.max(np.abs(np.asarray(peaks) - reference)) <= tolerance
+
+def test_float64_finds_echoes(simulate_capture):
+    plan   = make_plan(10)
+    delays = np.array([delay for delay, _ in DELAYS])
+    for seed in range(3):
+        rx = simulate_capture(plan, DELAYS, seed)
+        _assert_close(_peaks(demodulate_pulse(rx), plan, np.float64), delays,
+                      PEAK_TOLERANCE)
+
+def test_finds_echo_near_start(simulate_capture):
+    # The high-pass startup must not hide echoes close to lag 0.
+    plan  = make_plan(10)
+    rx    = simulate_capture(plan, [(30, 1.0), (2000, 0.5)])
+    _assert_close(_peaks(demodulate_pulse(rx), plan, np.float64, n=2),
+                  [30, 2000], PEAK_TOLERANCE)
+
+def test_noise_only_avoids_startup(simulate_capture):
+    # With no echoes, whatever is reported must not be the filter's startup
+    # transient near lag 0.
+    plan = make_plan(10)
+    for seed in range(3):
+        rx    = simulate_capture(plan, [], seed)
+        found = _peaks(demodulate_pulse(rx), plan, np.float64)
+        assert np.all(found > 16 * TIMESTRETCH)
+
+def test_float32_matches_float64(simulate_capture):
+    plan = make_plan(10)
+    for seed in range(3):
+        rx = simulate_capture(plan, DELAYS, seed)
+        reference = _peaks(demodulate_pulse(rx, dtype=np.float64), plan,
+                           np.float64)
+        demodulated = demodulate_pulse(rx, dtype=np.float32)
+        assert demodulated.dtype == np.float32
+        _assert_close(_peaks(demodulated, plan, np.float32), reference,
+                      PRECISION_TOLERANCE)
+
+def test_fixed_matches_float64(simulate_capture):
+    plan = make_plan(10)
+    for seed in range(3):
+        rx = simulate_capture(plan, DELAYS, seed)
+        reference = _peaks(demodulate_pulse(rx, dtype=np.float64), plan,
+                           np.float64)
+        demodulated = demodulate_fixed(rx)
+        assert demodulated.dtype == np.int32
+        for dtype in (np.float64, np.float32):
+            _assert_close(_peaks(demodulated, plan, dtype), reference,
+                          PRECISION_TOLERANCE)
+
+def test_fixed_is_scaled_float(simulate_capture):
+    rx = simulate_capture(make_plan(8), DELAYS[:1])
+    assert np.array_equal(demodulate_fixed(rx),
+                          8 * demodulate_pulse(rx, dtype=np.float64))
+
+def test_fixed_takes_only_int16(simulate_capture):
+    rx = simulate_capture(make_plan(8), DELAYS[:1])
+    assert np.array_equal(demodulate_fixed(array.array('h', rx.tobytes())),
+                          demodulate_fixed(rx))
+    for wrong in (rx.astype(np.int32), rx.astype(np.float32), list(rx)):
+        with pytest.raises(ValueError):
+            demodulate_fixed(wrong)
+
+def test_chunked_highpass_matches_whole(simulate_capture):
+    plan  = make_plan(10)
+    demod = demodulate_pulse(simulate_capture(plan, DELAYS))
+    for dtype in (np.float64, np.float32):
+        corr  = np.correlate(demod.astype(dtype), plan.ideal.astype(dtype),
+                             mode='valid')
+        filt  = HighPass(dtype=dtype)
+        # Uneven pieces, including an empty one and a single lag.
+        edges  = [0, 1, 1, 700, 701, 3000, len(corr)]
+        pieces = [filt.filter(corr[lo:hi]) for lo, hi in zip(edges, edges[1:])]
+        assert np.array_equal(np.concatenate(pieces), highpass(corr, dtype))
+
+def test_design_shared_and_read_only():
+    assert design_highpass(dtype=np.float32) is \
+           design_highpass(dtype=np.dtype('float32'))
+    assert not design_highpass().flags.writeable
@@ -0,0 +1,101 @@
+import json
+import os
+import subprocess
+import sys
+import wave
+
+import numpy as np
+import pytest
+from dsp.modulation import TIMESTRETCH
+from dsp.pipeline   import load_capture, make_plan, process_capture
+
+"""
+Batch processing of recorded captures, through the pipeline and through the
+ghettosonar command line tool.
+"""
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+DEGREE = 8
+# Reported lags may differ from the simulated delays by at most half a chip.
+PEAK_TOLERANCE = TIMESTRETCH // 2
+
+def _ghettosonar(*args):
+    return subprocess.run([sys.executable, os.path.join(ROOT, "ghettosonar"),
+                           "--degree", str(DEGREE)] + list(args),
+                          cwd=ROOT, capture_output=True, text=True)
+
+@pytest.fixture
+def captures(tmp_path, simulate_capture):
+    """
+    A directory of .npy captures, each with one echo, and their delays in
+    name order.
+    """
+    plan   = make_plan(DEGREE)
+    delays = [300, 900, 1400, 620, 1050]
+    for i, delay in enumerate(delays):
+        np.save(tmp_path / ("capture%02d.npy" % i),
+                simulate_capture(plan, [(delay, 1.0)], seed=i))
+    return tmp_path, delays
+
+def test_process_capture(captures):
+    directory, delays = captures
+    record = process_capture(str(directory / "capture00.npy"), DEGREE)
+    assert abs(record["reflections"][0] - delays[0]) <= PEAK_TOLERANCE
+    assert set(record["timings"]) == {"plan", "load", "demodulate", "correlate"}
+
+@pytest.mark.parametrize("jobs", ["1", "3"])
+def test_batch_reports_delays_in_order(captures, jobs):
+    directory, delays = captures
+    result = _ghettosonar("batch", str(directory), "--jobs", jobs)
+    assert result.returncode == 0, result.stderr
+
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [os.path.basename(r["source"]) for r in records] == \
+           ["capture%02d.npy" % i for i in range(len(delays))]
+    for record, delay in zip(records, delays):
+        assert len(record["reflections"]) == 1
+        assert abs(record["reflections"][0] - delay) <= PEAK_TOLERANCE
+        assert "timings" not in record
+
+def test_batch_profile(captures):
+    directory, _ = captures
+    result = _ghettosonar("--profile", "batch", str(directory))
+    assert result.returncode == 0, result.stderr
+    for line in result.stdout.splitlines():
+        assert "demodulate" in json.loads(line)["timings"]
+    assert "Stage timings" in result.stderr
+
+def test_batch_names_short_capture(captures):
+    directory, _ = captures
+    np.save(directory / "short.npy", np.zeros(100, dtype=np.int16))
+    result = _ghettosonar("batch", str(directory), "--jobs", "2")
+    assert result.returncode != 0
+    assert "short.npy" in result.stderr
+    assert "Traceback" not in result.stderr
+
+@pytest.mark.parametrize("args", [
+    ["-n", "0", "batch", "."],
+    ["--space", "0", "batch", "."],
+    ["batch", ".", "--jobs", "0"],
+    ["batch", "no-such-directory"],
+    ["live", "--rate", "0"],
+    ["live", "--count", "-1"],
+])
+def test_rejects_bad_arguments(args):
+    result = _ghettosonar(*args)
+    assert result.returncode == 2
+    assert "error:" in result.stderr
+
+def test_load_capture(tmp_path):
+    samples = np.arange(-500, 500, dtype=np.int16)
+    path = str(tmp_path / "capture.wav")
+    with wave.open(path, "wb") as capture:
+        capture.setnchannels(1)
+        capture.setsampwidth(2)
+        capture.setframerate(44100)
+        capture.writeframes(samples.tobytes())
+    assert np.array_equal(load_capture(path), samples)
+
+    np.save(tmp_path / "float.npy", samples.astype(np.float64))
+    with pytest.raises(ValueError):
+        load_capture(str(tmp_path / "float.npy"))
@@ -0,0 +1,93 @@
+import numpy as np
+from dsp.modulation import demodulate_pulse, find_reflections, highpass
+from dsp.pipeline   import make_plan
+from dsp.tracking   import Tracker, settle_length
+
+"""
+The Tracker only correlates and filters small windows of lags, so those
+windows must agree with filtering the whole correlation, and it must follow
+real echoes, falling back to a full search when it should.
+"""
+
+# Lags are reported this far before the simulated delays.
+OFFSET = -2
+
+def _ping(simulate_capture, plan, delays, seed):
+    return demodulate_pulse(simulate_capture(plan, delays, seed))
+
+def _full_search_ran(tracker):
+    return tracker.since_full == 0
+
+def test_windows_match_whole_array(simulate_capture):
+    plan    = make_plan(10)
+    demod   = _ping(simulate_capture, plan, [(1500, 1.0), (4000, 0.6)], 0)
+    whole   = highpass(np.correlate(demod, plan.ideal, mode='valid'))
+    tracker = Tracker(plan.ideal)
+
+    # Near the start (no room for a lead-in), on each echo, between them
+    # and at the very end. All but the first use the settled lead-in.
+    assert 1480 > settle_length()
+    for lo, hi in [(0, 40), (20, 60), (1480, 1520), (3980, 4020),
+                   (3000, 3040), (len(whole) - 40, len(whole))]:
+        window = tracker._local_highpassed(demod, lo, hi)
+        scale  = np.abs(whole).max()
+        assert np.allclose(window, whole[lo:hi], rtol=0, atol=1e-9 * scale)
+
+def test_follows_moving_target(simulate_capture):
+    plan    = make_plan(10)
+    tracker = Tracker(plan.ideal, n=2, full_every=100)
+    # Even steps: echoes at delays of opposite parity arrive with opposite
+    # carrier phase and partly cancel in demodulation, which moves the other
+    # peak a little and isn't what this test is about.
+    for ping in range(6):
+        delays = [(1500 + 2 * ping, 1.0), (4000, 0.6)]
+        demod  = _ping(simulate_capture, plan, delays, ping)
+        found  = tracker.update(demod)
+        assert sorted(found) == [1500 + 2 * ping + OFFSET, 4000 + OFFSET]
+        assert sorted(found) == sorted(find_reflections(demod, plan.ideal, n=2))
+        # Only the first ping needs a full search.
+        assert _full_search_ran(tracker) == (ping == 0)
+
+def test_jump_past_window_edge(simulate_capture):
+    plan    = make_plan(10)
+    tracker = Tracker(plan.ideal, n=2, window=16, full_every=100)
+    tracker.update(_ping(simulate_capture, plan, [(1500, 1.0), (4000, 0.6)], 0))
+
+    # The first echo jumps further than the window reaches.
+    found = tracker.update(_ping(simulate_capture, plan,
+                                 [(1540, 1.0), (4000, 0.6)], 1))
+    assert _full_search_ran(tracker)
+    assert sorted(found) == [1540 + OFFSET, 4000 + OFFSET]
+
+def test_lost_target(simulate_capture):
+    plan    = make_plan(10)
+    tracker = Tracker(plan.ideal, n=2, full_every=100, loss_ratio=0.5)
+    tracker.update(_ping(simulate_capture, plan, [(1500, 1.0), (4000, 0.6)], 0))
+
+    # The second echo fades to a fifth, well below loss_ratio.
+    found = tracker.update(_ping(simulate_capture, plan,
+                                 [(1500, 1.0), (4000, 0.12)], 1))
+    assert _full_search_ran(tracker)
+    assert 1500 + OFFSET in found
+
+def test_full_every(simulate_capture):
+    plan    = make_plan(10)
+    tracker = Tracker(plan.ideal, n=2, full_every=3)
+    ran     = []
+    for ping in range(7):
+        demod = _ping(simulate_capture, plan, [(1500, 1.0), (4000, 0.6)], ping)
+        found = tracker.update(demod)
+        assert sorted(found) == [1500 + OFFSET, 4000 + OFFSET]
+        ran.append(_full_search_ran(tracker))
+    assert ran == [True, False, False, False, True, False, False]
+
+def test_merging_targets(simulate_capture):
+    plan    = make_plan(10)
+    tracker = Tracker(plan.ideal, n=2, full_every=100)
+    tracker.update(_ping(simulate_capture, plan, [(1500, 1.0), (1540, 0.6)], 0))
+
+    # The second echo closes in on the first, into the first's window.
+    demod = _ping(simulate_capture, plan, [(1500, 1.0), (1512, 0.6)], 1)
+    found = tracker.update(demod)
+    assert _full_search_ran(tracker)
+    assert sorted(found) == sorted(find_reflections(demod, plan.ideal, n=2))